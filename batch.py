@@ -0,0 +1,89 @@
+import argparse
+import csv
+import json
+import sys
+from splinter_roi import check_rental_roi_batch
+
+# Run many ROI queries over one shared fetch and write the results
+#
+#   python batch.py queries.jsonl --output report.csv --workers 8
+#
+# Each line of the queries file is a JSON object with the check_rental_roi
+# arguments, plus an optional name used to label its results:
+#
+#   {"name": "CA legendaries", "edition": ["14"], "types": ["Monster"],
+#    "rarity": [4], "foil": 0, "bcx": 1, "colours": [], "length": 0}
+
+OUTPUT_FIELDS = ["query", "name", "roi", "avg rental price", "cards rented"]
+
+
+def read_queries(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# A result row without the icons markup, after the given label columns
+def get_output_row(card, **labels):
+    return {
+        **labels,
+        "name": card["name"],
+        "roi": card["roi"],
+        "avg rental price": float(card["avg rental price"]),
+        "cards rented": card["cards rented"],
+    }
+
+
+# One row per (query, card)
+def get_output_rows(queries, final_results):
+    for i, (query, result) in enumerate(zip(queries, final_results)):
+        label = query.get("name", str(i))
+        for card in result:
+            yield get_output_row(card, query=label)
+
+
+def write_rows(rows, output, output_format, fields=OUTPUT_FIELDS):
+    if output_format == "csv":
+        writer = csv.DictWriter(output, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            output.write(json.dumps(row) + "\n")
+
+
+# --output and --format, read by write_output
+def add_output_arguments(parser):
+    parser.add_argument("--output", help="output file (default: stdout)")
+    parser.add_argument(
+        "--format",
+        choices=["jsonl", "csv"],
+        help="output format (default: from the output extension, else jsonl)",
+    )
+
+
+def write_output(rows, args, fields=OUTPUT_FIELDS):
+    output_format = args.format
+    if output_format is None:
+        output_format = "csv" if args.output and args.output.endswith(".csv") else "jsonl"
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as output:
+            write_rows(rows, output, output_format, fields)
+    else:
+        write_rows(rows, sys.stdout, output_format, fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many ROI queries over one fetch")
+    parser.add_argument("queries", help="JSON Lines file of query specs")
+    add_output_arguments(parser)
+    parser.add_argument("--workers", type=int, default=8, help="parallel requests")
+    args = parser.parse_args()
+
+    queries = read_queries(args.queries)
+    final_results = check_rental_roi_batch(queries, workers=args.workers)
+    write_output(get_output_rows(queries, final_results), args)
+
+
+if __name__ == "__main__":
+    main()
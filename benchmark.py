@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Offline benchmark: runs check_rental_roi end to end against a local
+# stand-in for the Splinterlands API, serving synthetic or recorded payloads,
+# and reports the phases recorded by check_rental_roi_with_stats
+#
+#   python benchmark.py --cards 200 --rentals 300 --latency 50 --workers 8
+#   python benchmark.py --data-dir recorded/ --memory --store
+#
+# A recorded data dir holds get_details.json, for_sale_grouped.json and
+# active_rentals/<card_detail_id>.json, as returned by the API
+
+EDITIONS = ["14"]
+TYPES = ["Monster", "Summoner"]
+RARITIES = [1, 2, 3, 4]
+COLOURS = ["Red", "Blue", "Green", "White", "Black", "Gold", "Gray"]
+
+
+def make_cards(cards_count):
+    return [
+        {
+            "id": card_id,
+            "name": f"Card {card_id}",
+            "game_type": "splinterlands",
+            "editions": EDITIONS[0],
+            "type": TYPES[card_id % len(TYPES)],
+            "rarity": RARITIES[card_id % len(RARITIES)],
+            "color": COLOURS[card_id % len(COLOURS)],
+        }
+        for card_id in range(1, cards_count + 1)
+    ]
+
+
+def make_market(cards, rng):
+    return [
+        {
+            "card_detail_id": card["id"],
+            "foil": foil,
+            "low_price_bcx": round(rng.uniform(0.5, 200), 3),
+        }
+        for card in cards
+        for foil in (0, 1, 2, 3, 4)
+    ]
+
+
+def make_rentals(card_id, rentals_count, rng):
+    now = datetime.now(timezone.utc)
+    rentals = []
+    for i in range(rentals_count):
+        rental_date = now - timedelta(days=rng.uniform(0, 45))
+        rentals.append(
+            {
+                "id": f"{card_id}-{i}",
+                "card_detail_id": card_id,
+                "rental_date": rental_date.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+                "rental_type": rng.choice(["season", "season", "season", "daily"]),
+                "rental_days": rng.randint(1, 20),
+                "foil": rng.choice([0, 0, 0, 1]),
+                "xp": rng.choice([1, 1, 1, 38]),
+                "payment_currency": rng.choice(["DEC", "DEC", "DEC", "SPS"]),
+                "buy_price": f"{rng.uniform(0.05, 10):.3f}",
+            }
+        )
+    return rentals
+
+
+def load_payloads(data_dir):
+    with open(os.path.join(data_dir, "get_details.json"), encoding="utf-8") as f:
+        cards = json.load(f)
+    with open(os.path.join(data_dir, "for_sale_grouped.json"), encoding="utf-8") as f:
+        market = json.load(f)
+
+    rentals = {}
+    rentals_dir = os.path.join(data_dir, "active_rentals")
+    for file_name in os.listdir(rentals_dir):
+        with open(os.path.join(rentals_dir, file_name), encoding="utf-8") as f:
+            rentals[int(os.path.splitext(file_name)[0])] = json.load(f)
+
+    return cards, market, rentals
+
+
+def make_payloads(cards_count, rentals_count, seed):
+    rng = random.Random(seed)
+    cards = make_cards(cards_count)
+    market = make_market(cards, rng)
+    rentals = {
+        card["id"]: make_rentals(card["id"], rentals_count, rng) for card in cards
+    }
+    return cards, market, rentals
+
+
+# Local API stand-in: bodies are encoded once, latency is added per request
+def start_server(cards, market, rentals, latency):
+    bodies = {
+        "/cards/get_details": json.dumps(cards).encode(),
+        "/market/for_sale_grouped": json.dumps(market).encode(),
+    }
+    rental_bodies = {
+        card_id: json.dumps(card_rentals).encode()
+        for card_id, card_rentals in rentals.items()
+    }
+    stats = {"requests": 0, "bytes": 0}
+    stats_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes: with Nagle's algorithm
+        # on, the client's delayed ACK adds ~40 ms to every request
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/market/active_rentals":
+                card_id = int(parse_qs(url.query)["card_detail_id"][0])
+                body = rental_bodies.get(card_id, b"[]")
+            else:
+                body = bodies.get(url.path)
+
+            if body is None:
+                self.send_error(404)
+                return
+
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+            with stats_lock:
+                stats["requests"] += 1
+                stats["bytes"] += len(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+# Time one cold-cache check_rental_roi: returns its phases, wall time and
+# (if tracing) peak memory
+def run_once(sr, session, args, store):
+    sr.invalidate_catalog()
+    sr.invalidate_market()
+
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    # check_rental_roi prints every result row
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        _, query_stats = sr.check_rental_roi_with_stats(
+            EDITIONS,
+            TYPES,
+            RARITIES,
+            args.foil,
+            args.bcx,
+            [],
+            args.length,
+            session,
+            workers=args.workers,
+            stream_market=args.stream_market,
+            store=store,
+        )
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+    return query_stats.phases, elapsed, peak
+
+
+def print_report(runs, stats, memory):
+    print(f"{'phase':<22}{'best (s)':>12}{'mean (s)':>12}")
+
+    names = list(dict.fromkeys(name for phases, _, _ in runs for name in phases))
+    for name in names:
+        times = [phases.get(name, 0) for phases, _, _ in runs]
+        print(f"{name:<22}{min(times):>12.4f}{sum(times) / len(times):>12.4f}")
+
+    totals = [elapsed for _, elapsed, _ in runs]
+    print(f"{'total':<22}{min(totals):>12.4f}{sum(totals) / len(totals):>12.4f}")
+    if memory:
+        peak = max(peak for _, _, peak in runs)
+        print(f"\npeak traced memory {peak / 2 ** 20:.2f} MiB")
+    print(
+        f"\n{stats['requests'] / len(runs):.0f} requests and "
+        f"{stats['bytes'] / len(runs) / 2 ** 20:.2f} MiB served per run"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of check_rental_roi")
+    parser.add_argument("--cards", type=int, default=100, help="synthetic catalog size")
+    parser.add_argument("--rentals", type=int, default=200, help="synthetic rentals per card")
+    parser.add_argument("--data-dir", help="serve recorded payloads from this directory")
+    parser.add_argument("--latency", type=float, default=0, help="added latency per request (ms)")
+    parser.add_argument("--workers", type=int, default=1, help="parallel active_rentals requests")
+    parser.add_argument("--stream-market", action="store_true", help="stream for_sale_grouped")
+    parser.add_argument("--foil", type=int, default=0)
+    parser.add_argument("--bcx", type=int, default=1)
+    parser.add_argument("--length", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--memory", action="store_true", help="trace peak memory (slower)")
+    parser.add_argument(
+        "--store", action="store_true", help="read rentals through a fresh rentals store"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.data_dir:
+        cards, market, rentals = load_payloads(args.data_dir)
+    else:
+        cards, market, rentals = make_payloads(args.cards, args.rentals, args.seed)
+
+    server, stats = start_server(cards, market, rentals, args.latency / 1000)
+
+    # splinter_roi reads the API URL when it is imported
+    os.environ["SPLINTERLANDS_API_URL"] = f"http://127.0.0.1:{server.server_port}"
+    import splinter_roi as sr
+    from rentals_store import open_store
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        sr.CATALOG_CACHE_FILE = os.path.join(cache_dir, "card_catalog.json")
+        store = open_store(os.path.join(cache_dir, "rentals.db")) if args.store else None
+
+        if args.memory:
+            tracemalloc.start()
+
+        runs = []
+        session = sr.get_session()
+        for _ in range(args.repeat):
+            runs.append(run_once(sr, session, args, store))
+        sr.close_session()
+        if store is not None:
+            store.close()
+
+        if args.memory:
+            tracemalloc.stop()
+
+    server.shutdown()
+    print_report(runs, stats, args.memory)
+
+
+if __name__ == "__main__":
+    main()
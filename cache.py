@@ -0,0 +1,34 @@
+import json
+import os
+import time
+
+
+# Return (data, fetched_at) stored in path, or (None, 0) if missing,
+# unreadable or older than ttl seconds
+def read_json_cache(path, ttl):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None, 0
+
+    fetched_at = cached.get("fetched_at", 0)
+    if time.time() - fetched_at > ttl:
+        return None, 0
+
+    return cached.get("data"), fetched_at
+
+
+# Write data to path atomically, so readers never see a half-written file
+def write_json_cache(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"fetched_at": time.time(), "data": data}, f)
+    os.replace(tmp_path, path)
+
+
+def remove_cache(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
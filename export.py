@@ -0,0 +1,65 @@
+import math
+from xlsxwriter import Workbook
+
+# ROI colour bands, as in the Streamlit results table: (minimum ROI, colour),
+# anything lower or missing is BELOW_BANDS_COLOR
+ROI_BANDS = [(30, "lime"), (20, "gold"), (10, "orange")]
+BELOW_BANDS_COLOR = "tomato"
+
+# Excel has no CSS colour names
+HEX_COLORS = {"lime": "#00FF00", "gold": "#FFD700", "orange": "#FFA500", "tomato": "#FF6347"}
+
+COLUMNS = [
+    ("Card", "name", 40),
+    ("ROI", "roi", 10),
+    ("Rental Price (avg)", "avg rental price", 20),
+    ("Amount of Cards Rented", "cards rented", 25),
+]
+
+
+def get_roi_color(roi):
+    try:
+        roi = float(roi)
+    except (ValueError, TypeError):
+        return BELOW_BANDS_COLOR
+    if math.isnan(roi):
+        return BELOW_BANDS_COLOR
+
+    for minimum, color in ROI_BANDS:
+        if roi >= minimum:
+            return color
+    return BELOW_BANDS_COLOR
+
+
+# Write result rows (as returned by check_rental_roi) to an .xlsx file path or
+# file object. The workbook is in constant memory mode: each row is flushed
+# to disk as soon as it is written, so rows can be any iterable, including
+# the iter_rental_roi generator. Cards not fetched in time (see
+# get_partial_result_rows) are marked next to their name
+def export_xlsx(rows, output, sheet_name="ROI"):
+    workbook = Workbook(output, {"constant_memory": True})
+    worksheet = workbook.add_worksheet(sheet_name)
+
+    header_format = workbook.add_format({"bold": True})
+    roi_formats = {
+        color: workbook.add_format(
+            {"bg_color": HEX_COLORS[color], "font_color": "black", "num_format": "0.00"}
+        )
+        for color in [color for _, color in ROI_BANDS] + [BELOW_BANDS_COLOR]
+    }
+    price_format = workbook.add_format({"num_format": "0.0000"})
+
+    for col, (title, _, width) in enumerate(COLUMNS):
+        worksheet.set_column(col, col, width)
+        worksheet.write(0, col, title, header_format)
+
+    for row_number, row in enumerate(rows, start=1):
+        name = row["name"]
+        if row.get("status") == "not fetched":
+            name += " (not fetched in time)"
+        worksheet.write_string(row_number, 0, name)
+        worksheet.write(row_number, 1, row["roi"], roi_formats[get_roi_color(row["roi"])])
+        worksheet.write_number(row_number, 2, float(row["avg rental price"]), price_format)
+        worksheet.write_number(row_number, 3, row["cards rented"])
+
+    workbook.close()
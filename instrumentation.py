@@ -0,0 +1,84 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Per-query counters and phase timings. The query being measured is held in a
+# context variable: code running in executor threads must be submitted with
+# contextvars.copy_context().run to be counted
+_current_stats = ContextVar("query_stats", default=None)
+
+
+class QueryStats:
+    __slots__ = ("phases", "counters", "profile", "_lock")
+
+    def __init__(self):
+        self.phases = {}  # seconds per phase, in first-seen order
+        self.counters = {"requests": 0, "bytes": 0, "rows parsed": 0, "rows kept": 0}
+        self.profile = None
+        self._lock = threading.Lock()
+
+    def add(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def to_dict(self):
+        with self._lock:
+            return {"phases": dict(self.phases), **self.counters}
+
+    def summary(self):
+        stats = self.to_dict()
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in stats.pop("phases").items())
+        counters = ", ".join(f"{value} {name}" for name, value in stats.items())
+        return f"{phases} | {counters}"
+
+    # Top functions by cumulative time, if the query was profiled
+    def profile_report(self, limit=20):
+        if self.profile is None:
+            return ""
+        output = io.StringIO()
+        pstats.Stats(self.profile, stream=output).sort_stats("cumulative").print_stats(limit)
+        return output.getvalue()
+
+
+def add_stat(name, value):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.add(name, value)
+
+
+@contextmanager
+def phase(name):
+    stats = _current_stats.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_phase(name, time.perf_counter() - start)
+
+
+# Measure everything run inside the block. With profile=True the calling
+# thread is also run under cProfile (executor threads are not profiled)
+@contextmanager
+def collect_stats(profile=False):
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    if profile:
+        stats.profile = cProfile.Profile()
+        stats.profile.enable()
+    try:
+        yield stats
+    finally:
+        if profile:
+            stats.profile.disable()
+        _current_stats.reset(token)
@@ -0,0 +1,154 @@
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from splinter_roi import (
+    CARDS_URL,
+    MARKET_URL,
+    RENTALS_URL,
+    logger,
+    get_response,
+    get_catalog,
+    get_catalog_index,
+    get_positions,
+    store_catalog,
+    store_market,
+    mount_pool,
+    get_session,
+)
+from rentals_store import open_store, store_card_rentals
+
+# Background refresher keeping the caches read by the query path warm: the
+# card catalog, the market snapshot and the rentals store for the configured
+# editions. Intervals are below CATALOG_TTL, MARKET_TTL and RENTALS_TTL so
+# interactive queries find fresh data
+CATALOG_INTERVAL = 6 * 60 * 60  # seconds
+MARKET_INTERVAL = 50  # seconds
+RENTALS_INTERVAL = 5 * 60  # seconds
+PREFETCH_WORKERS = 4
+
+# When each cache was last refreshed by the prefetcher, and the last error
+_status = {"catalog": None, "market": None, "rentals": None, "error": None}
+_status_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def get_prefetch_status():
+    with _status_lock:
+        return dict(_status)
+
+
+def set_status(key, value):
+    with _status_lock:
+        _status[key] = value
+
+
+def refresh_catalog(session: requests.Session):
+    store_catalog(get_response(CARDS_URL, session))
+    set_status("catalog", time.time())
+
+
+def refresh_market(session: requests.Session):
+    store_market(get_response(MARKET_URL, session))
+    set_status("market", time.time())
+
+
+# Refresh the rentals of every card of the editions; a card that fails is
+# logged and skipped. Returns the number of cards that failed
+def refresh_rentals(editions, store, session: requests.Session, workers):
+    all_cards = get_catalog(session)
+    index = get_catalog_index(all_cards)
+    card_ids = [all_cards[position]["id"] for position in get_positions(index["editions"], editions)]
+
+    def refresh_card(card_id):
+        try:
+            store_card_rentals(store, card_id, get_response(RENTALS_URL.format(card_id), session))
+            return True
+        except Exception as e:
+            logger.error(f"Prefetch of the rentals of card {card_id} failed: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        failed = list(executor.map(refresh_card, card_ids)).count(False)
+    set_status("rentals", time.time())
+    return failed
+
+
+def run_prefetcher(
+    editions,
+    store,
+    market_interval=MARKET_INTERVAL,
+    rentals_interval=RENTALS_INTERVAL,
+    workers=PREFETCH_WORKERS,
+    catalog_interval=CATALOG_INTERVAL,
+):
+    # market_interval=None: no market refresh
+    next_market = 0 if market_interval is not None else float("inf")
+    next_catalog = next_rentals = 0
+    session = get_session()
+    mount_pool(session, workers)
+    while not _stop.is_set():
+        now = time.time()
+        error = None
+        try:
+            if now >= next_catalog:
+                next_catalog = now + catalog_interval
+                refresh_catalog(session)
+            if now >= next_market:
+                next_market = now + market_interval
+                refresh_market(session)
+            if now >= next_rentals:
+                next_rentals = now + rentals_interval
+                failed = refresh_rentals(editions, store, session, workers)
+                if failed:
+                    error = f"rentals of {failed} cards could not be refreshed"
+        except Exception as e:
+            logger.error(f"Prefetch failed: {e}")
+            error = str(e)
+        set_status("error", error)
+
+        _stop.wait(max(min(next_catalog, next_market, next_rentals) - time.time(), 1))
+
+
+# Start the prefetcher in a daemon thread of this process
+def start_prefetcher(editions, store, **kwargs):
+    _stop.clear()
+    thread = threading.Thread(
+        target=run_prefetcher, args=(editions, store), kwargs=kwargs, daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def stop_prefetcher():
+    _stop.set()
+
+
+# Standalone mode: only the catalog file and the rentals store are shared
+# with other processes. A market snapshot would stay in this one, so the
+# market is not refreshed. Run the Streamlit app with
+# SPLINTER_ROI_BACKGROUND_REFRESH=0 so it does not start its own prefetcher
+def main():
+    parser = argparse.ArgumentParser(description="Keep the SplinterROI caches warm")
+    parser.add_argument("--editions", nargs="+", default=["14", "17", "18"])
+    parser.add_argument("--catalog-interval", type=float, default=CATALOG_INTERVAL)
+    parser.add_argument("--rentals-interval", type=float, default=RENTALS_INTERVAL)
+    parser.add_argument("--workers", type=int, default=PREFETCH_WORKERS)
+    args = parser.parse_args()
+
+    try:
+        run_prefetcher(
+            args.editions,
+            open_store(),
+            None,
+            args.rentals_interval,
+            args.workers,
+            args.catalog_interval,
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from array import array
+import numpy as np
+
+
+# Valid rentals of one or more cards, stored as typed columns instead of one
+# dict per rental
+class RentalColumns:
+    __slots__ = ("card_ids", "rental_days", "rental_prices")
+
+    def __init__(self):
+        self.card_ids = array("q")
+        self.rental_days = array("q")
+        self.rental_prices = array("d")
+
+    def __len__(self):
+        return len(self.card_ids)
+
+    def append(self, card_id, rental_days, rental_price):
+        self.card_ids.append(card_id)
+        self.rental_days.append(rental_days)
+        self.rental_prices.append(rental_price)
+
+    def extend(self, other):
+        self.card_ids.extend(other.card_ids)
+        self.rental_days.extend(other.rental_days)
+        self.rental_prices.extend(other.rental_prices)
+
+    # Zero-copy (card id, days, price) NumPy views of the columns
+    def to_numpy(self):
+        return (
+            np.frombuffer(self.card_ids, dtype=np.int64),
+            np.frombuffer(self.rental_days, dtype=np.int64),
+            np.frombuffer(self.rental_prices, dtype=np.float64),
+        )
+
+    # Same format as get_valid_active_rentals
+    def to_dicts(self):
+        return [
+            {
+                "rental_price": rental_price,
+                "rental_days": rental_days,
+                "card_detail_id": card_id,
+            }
+            for card_id, rental_days, rental_price in zip(
+                self.card_ids, self.rental_days, self.rental_prices
+            )
+        ]
+
+
+# A card together with its valid rentals
+class CardRentals:
+    __slots__ = ("id", "name", "icons", "rentals")
+
+    def __init__(self, id, name, icons, rentals):
+        self.id = id
+        self.name = name
+        self.icons = icons
+        self.rentals = rentals
+
+
+# Market price and [[price, count] per length bucket] rental prices of a card.
+# complete is False when its rentals could not be fetched
+class CardResult:
+    __slots__ = ("id", "name", "icons", "price", "rental_prices", "complete")
+
+    def __init__(self, id, name, icons, price, rental_prices, complete=True):
+        self.id = id
+        self.name = name
+        self.icons = icons
+        self.price = price
+        self.rental_prices = rental_prices
+        self.complete = complete
@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+import time
+
+# Local copy of the active rentals of each card. The active_rentals endpoint
+# has no "changed since" parameter, so a card's rentals are replaced as a
+# whole when they are older than RENTALS_TTL and read locally otherwise
+RENTALS_DB_FILE = "rentals.db"
+RENTALS_TTL = 10 * 60  # seconds
+
+_store_lock = threading.Lock()
+
+
+def open_store(path=RENTALS_DB_FILE):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    with _store_lock, conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rentals (
+                card_detail_id INTEGER NOT NULL,
+                rental_index INTEGER NOT NULL,
+                rental_date TEXT NOT NULL,
+                rental_type TEXT,
+                rental_days INTEGER,
+                foil INTEGER,
+                xp INTEGER,
+                payment_currency TEXT,
+                buy_price REAL,
+                PRIMARY KEY (card_detail_id, rental_index)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS rentals_lookup
+            ON rentals (card_detail_id, foil, xp, rental_date)
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS refreshes (
+                card_detail_id INTEGER PRIMARY KEY,
+                refreshed_at REAL NOT NULL
+            )
+            """
+        )
+    return conn
+
+
+def is_stale(conn, card_id, ttl=RENTALS_TTL):
+    with _store_lock:
+        row = conn.execute(
+            "SELECT refreshed_at FROM refreshes WHERE card_detail_id = ?", (card_id,)
+        ).fetchone()
+    return row is None or time.time() - row[0] > ttl
+
+
+# Replace the stored rentals of a card with the ones just fetched
+def store_card_rentals(conn, card_id, active_rentals):
+    rows = [
+        (
+            card_id,
+            rental_index,
+            rental["rental_date"],
+            rental["rental_type"],
+            rental["rental_days"],
+            rental["foil"],
+            rental["xp"],
+            rental["payment_currency"],
+            float(rental["buy_price"]),
+        )
+        for rental_index, rental in enumerate(active_rentals)
+    ]
+    with _store_lock, conn:
+        conn.execute("DELETE FROM rentals WHERE card_detail_id = ?", (card_id,))
+        conn.executemany("INSERT INTO rentals VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute(
+            "INSERT OR REPLACE INTO refreshes VALUES (?, ?)", (card_id, time.time())
+        )
+
+
+# (rental_date, rental_days, buy_price) of the season DEC rentals of a card
+# made in or after the second past_days_prefix (YYYY-MM-DDTHH:MM:SS)
+def query_rentals(conn, card_id, past_days_prefix, foil, bcx):
+    with _store_lock:
+        return conn.execute(
+            """
+            SELECT rental_date, rental_days, buy_price FROM rentals
+            WHERE card_detail_id = ? AND foil = ? AND xp = ?
+                AND rental_date >= ?
+                AND rental_type = 'season' AND payment_currency = 'DEC'
+            ORDER BY rental_index
+            """,
+            (card_id, foil, bcx, past_days_prefix),
+        ).fetchall()
+
+
+def clear_store(conn):
+    with _store_lock, conn:
+        conn.execute("DELETE FROM rentals")
+        conn.execute("DELETE FROM refreshes")
@@ -0,0 +1,148 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Per-card ROI figures of every run, so trends can be charted without any
+# new API call. run_at is stored in both tables so that per-card and
+# per-query range lookups are answered from an index
+ROI_HISTORY_DB_FILE = "roi_history.db"
+
+_history_lock = threading.Lock()
+
+
+def open_history(path=ROI_HISTORY_DB_FILE):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    with _history_lock, conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY,
+                run_at REAL NOT NULL,
+                query_key TEXT NOT NULL,
+                foil INTEGER,
+                bcx INTEGER,
+                length INTEGER
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS snapshots (
+                run_id INTEGER NOT NULL REFERENCES runs (run_id),
+                run_at REAL NOT NULL,
+                card_detail_id INTEGER NOT NULL,
+                name TEXT,
+                market_price REAL,
+                rental_price REAL,
+                cards_rented INTEGER,
+                roi REAL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS runs_query ON runs (query_key, run_at)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS snapshots_card ON snapshots (card_detail_id, run_at)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS snapshots_run ON snapshots (run_id)")
+    return conn
+
+
+# Canonical form of a query, so equal filters map to the same key
+def get_query_key(edition, types, rarity, foil, bcx, colours, length):
+    return json.dumps(
+        {
+            "edition": sorted(map(str, edition)),
+            "types": sorted(types),
+            "rarity": sorted(rarity),
+            "foil": foil,
+            "bcx": bcx,
+            "colours": sorted(colours),
+            "length": length,
+        },
+        sort_keys=True,
+    )
+
+
+# rows: dicts with id, name, price, rental_price, cards_rented and roi
+# ("N/A" when it can't be computed)
+def save_snapshot(conn, query_key, foil, bcx, length, rows, run_at=None):
+    run_at = time.time() if run_at is None else run_at
+    with _history_lock, conn:
+        run_id = conn.execute(
+            "INSERT INTO runs (run_at, query_key, foil, bcx, length) VALUES (?, ?, ?, ?, ?)",
+            (run_at, query_key, foil, bcx, length),
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    run_id,
+                    run_at,
+                    row["id"],
+                    row["name"],
+                    row["price"],
+                    float(row["rental_price"]),
+                    row["cards_rented"],
+                    None if row["roi"] == "N/A" else float(row["roi"]),
+                )
+                for row in rows
+            ],
+        )
+    return run_id
+
+
+# ROI of one card over [start, end] (datetimes), oldest first, optionally
+# restricted to a foil, bcx and rental length
+def get_card_roi_trend(conn, card_id, start, end, foil=None, bcx=None, length=None):
+    with _history_lock:
+        rows = conn.execute(
+            """
+            SELECT s.run_at, s.market_price, s.rental_price, s.cards_rented, s.roi
+            FROM snapshots s JOIN runs r ON r.run_id = s.run_id
+            WHERE s.card_detail_id = ? AND s.run_at BETWEEN ? AND ?
+                AND (? IS NULL OR r.foil = ?)
+                AND (? IS NULL OR r.bcx = ?)
+                AND (? IS NULL OR r.length = ?)
+            ORDER BY s.run_at
+            """,
+            (card_id, start.timestamp(), end.timestamp(), foil, foil, bcx, bcx, length, length),
+        ).fetchall()
+    return [
+        {
+            "run_at": run_at,
+            "price": market_price,
+            "rental_price": rental_price,
+            "cards_rented": cards_rented,
+            "roi": "N/A" if roi is None else roi,
+        }
+        for run_at, market_price, rental_price, cards_rented, roi in rows
+    ]
+
+
+# ROI of every card of the runs of a query over [start, end], oldest first
+def get_query_roi_trend(conn, query_key, start, end):
+    with _history_lock:
+        rows = conn.execute(
+            """
+            SELECT s.run_at, s.card_detail_id, s.name, s.market_price,
+                s.rental_price, s.cards_rented, s.roi
+            FROM runs r JOIN snapshots s ON s.run_id = r.run_id
+            WHERE r.query_key = ? AND r.run_at BETWEEN ? AND ?
+            ORDER BY r.run_at
+            """,
+            (query_key, start.timestamp(), end.timestamp()),
+        ).fetchall()
+    return [
+        {
+            "run_at": run_at,
+            "id": card_id,
+            "name": name,
+            "price": market_price,
+            "rental_price": rental_price,
+            "cards_rented": cards_rented,
+            "roi": "N/A" if roi is None else roi,
+        }
+        for run_at, card_id, name, market_price, rental_price, cards_rented, roi in rows
+    ]
@@ -1,9 +1,34 @@
 import requests
 import json
 import logging
-from datetime import datetime, timedelta
+import multiprocessing
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 import numpy as np
+import ijson
+import urllib3
 from collections import defaultdict
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    TimeoutError,
+    as_completed,
+)
+from contextvars import copy_context
+from functools import lru_cache
+from itertools import product
+from requests.adapters import HTTPAdapter
+from cache import read_json_cache, write_json_cache, remove_cache
+from rentals_store import is_stale, store_card_rentals, query_rentals
+from roi_history import get_query_key, save_snapshot
+from instrumentation import add_stat, phase, collect_stats
+from records import RentalColumns, CardRentals, CardResult
+from sketch import QuantileSketch
 from icons import edition_icons, card_type_icons, rarity_icons, color_icons
 
 
@@ -20,17 +45,281 @@ def get_logger():
 
 logger = get_logger()
 
+API_URL = os.environ.get("SPLINTERLANDS_API_URL", "https://api.splinterlands.com")
+CARDS_URL = f"{API_URL}/cards/get_details"
+MARKET_URL = f"{API_URL}/market/for_sale_grouped"
+RENTALS_URL = f"{API_URL}/market/active_rentals?card_detail_id={{}}"
+
+# The card catalog only changes when a new edition ships
+CATALOG_CACHE_FILE = "card_catalog.json"
+CATALOG_TTL = 24 * 60 * 60  # seconds
+
+_catalog = {"cards": None, "loaded_at": 0, "index": None}
+_catalog_lock = threading.Lock()
+
+# Market snapshots younger than MARKET_TTL are served as is; older ones, up to
+# MARKET_STALE_TTL, are served while a background thread refreshes them
+MARKET_TTL = 60  # seconds
+MARKET_STALE_TTL = 300  # seconds
+
+_market = {"listings": None, "fetched_at": 0, "refreshing": False}
+_market_lock = threading.Lock()
+
+
+# Pooled session shared by every query of this process (see get_session)
+SESSION_POOL_SIZE = 16
+
+_session = None
+_session_lock = threading.Lock()
+
+# Requests currently being sent, by URL
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+# Retries with jittered exponential backoff, honouring Retry-After
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_MAX = 8  # seconds
+RETRY_AFTER_MAX = 60  # seconds
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RATE_LIMITED_STATUS_CODE = 429
+REQUEST_TIMEOUT = 30  # seconds
+
+# After CIRCUIT_FAILURE_THRESHOLD consecutive failed requests, each counted
+# once after its retries, every request fails fast for CIRCUIT_RESET_TIMEOUT
+# seconds, then one is let through again. Rate limited requests (429) are
+# not failures: they mean slow down, not API down
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30  # seconds
+
+_circuit = {"failures": 0, "opened_at": None}
+_circuit_lock = threading.Lock()
+
+
+class ApiUnavailableError(Exception):
+    pass
+
+
+# Raised by requests of a query whose cancel event (a threading.Event) is set
+class QueryCancelledError(Exception):
+    pass
+
+
+def check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise QueryCancelledError("Query cancelled")
+
+
+def check_circuit():
+    with _circuit_lock:
+        opened_at = _circuit["opened_at"]
+        if opened_at is None:
+            return
+        if time.time() - opened_at < CIRCUIT_RESET_TIMEOUT:
+            raise ApiUnavailableError("Splinterlands API unavailable, try again later")
+        # Half open: let this request through, a failure reopens the circuit
+        _circuit["opened_at"] = time.time()
+
+
+def record_success():
+    with _circuit_lock:
+        _circuit["failures"] = 0
+        _circuit["opened_at"] = None
+
+
+def record_failure():
+    with _circuit_lock:
+        _circuit["failures"] += 1
+        if _circuit["failures"] >= CIRCUIT_FAILURE_THRESHOLD:
+            if _circuit["opened_at"] is None:
+                logger.error("Too many failed requests, opening the circuit")
+            _circuit["opened_at"] = time.time()
+
+
+# Seconds to wait before retry number attempt (0 based)
+def get_retry_delay(attempt, retry_after=None):
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                retry_date = parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                retry_date = None
+            delay = (
+                (retry_date - datetime.now(timezone.utc)).total_seconds()
+                if retry_date
+                else None
+            )
+        if delay is not None:
+            return min(max(delay, 0), RETRY_AFTER_MAX)
+
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+# Log a failed attempt and wait before the next one; a cancelled query stops
+# waiting at once
+def wait_before_retry(url, attempt, error, retry_after, cancel=None):
+    delay = get_retry_delay(attempt, retry_after)
+    logger.warning(f"Request to {url} failed ({error}), retrying in {delay:.1f}s")
+    if cancel is None:
+        time.sleep(delay)
+    elif cancel.wait(delay):
+        check_cancelled(cancel)
+
+
+# Error of a request that failed every attempt, counted once toward the
+# circuit breaker unless it was rate limited
+def get_request_error(url, attempts, error, rate_limited):
+    if not rate_limited:
+        record_failure()
+    return ApiUnavailableError(f"Request to {url} failed after {attempts} attempts: {error}")
+
 
 # Send request, get response, return decoded JSON response
-def get_response(url, session: requests.Session):
-    request = requests.Request("GET", url=url).prepare()
-    response_json = session.send(request, allow_redirects=False)
-    if response_json.status_code == 502:
-        pass
-    response = response_json.json()
-    return response
+def send_request(url, session: requests.Session, cancel=None):
+    check_cancelled(cancel)
+    check_circuit()
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        rate_limited = False
+        request = requests.Request("GET", url=url).prepare()
+        try:
+            response_json = session.send(
+                request, allow_redirects=False, timeout=REQUEST_TIMEOUT
+            )
+            if response_json.status_code in RETRY_STATUS_CODES:
+                retry_after = response_json.headers.get("Retry-After")
+                rate_limited = response_json.status_code == RATE_LIMITED_STATUS_CODE
+                error = f"status code {response_json.status_code}"
+            else:
+                add_stat("requests", 1)
+                # Bytes read from the wire, compressed, as in stream_response_items
+                add_stat("bytes", response_json.raw.tell())
+                response = response_json.json()
+                record_success()
+                return response
+        except (requests.RequestException, json.JSONDecodeError) as e:
+            error = e
+
+        if attempt == MAX_RETRIES:
+            raise get_request_error(url, attempt + 1, error, rate_limited)
+        wait_before_retry(url, attempt, error, retry_after, cancel)
+
+
+# Concurrent callers asking for the same URL wait on a single request and
+# share its decoded response, which must therefore not be modified
+def get_response(url, session: requests.Session, cancel=None):
+    while True:
+        with _in_flight_lock:
+            future = _in_flight.get(url)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                _in_flight[url] = future
 
+        if is_leader:
+            break
 
+        try:
+            return future.result()
+        except QueryCancelledError:
+            # The request was cancelled by another query: send it again
+            check_cancelled(cancel)
+
+    try:
+        response = send_request(url, session, cancel)
+        future.set_result(response)
+        return response
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[url]
+
+
+# Send request and yield the items of the JSON array response one at a time,
+# parsing the body incrementally as it arrives. Same timeout, retries and
+# circuit breaker as send_request up to the response headers; once items
+# were yielded a failure can't be retried and raises ApiUnavailableError
+def stream_response_items(url, session: requests.Session, cancel=None):
+    check_cancelled(cancel)
+    check_circuit()
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        rate_limited = False
+        request = requests.Request("GET", url=url).prepare()
+        try:
+            response = session.send(
+                request, allow_redirects=False, stream=True, timeout=REQUEST_TIMEOUT
+            )
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+            retry_after = response.headers.get("Retry-After")
+            rate_limited = response.status_code == RATE_LIMITED_STATUS_CODE
+            error = f"status code {response.status_code}"
+            response.close()
+        except requests.RequestException as e:
+            error = e
+
+        if attempt == MAX_RETRIES:
+            raise get_request_error(url, attempt + 1, error, rate_limited)
+        wait_before_retry(url, attempt, error, retry_after, cancel)
+
+    with response:
+        response.raw.decode_content = True
+        try:
+            for item in ijson.items(response.raw, "item", use_float=True):
+                check_cancelled(cancel)
+                yield item
+        except (urllib3.exceptions.HTTPError, OSError, ijson.JSONError) as e:
+            record_failure()
+            raise ApiUnavailableError(f"Request to {url} failed while streaming: {e}")
+        record_success()
+        add_stat("requests", 1)
+        add_stat("bytes", response.raw.tell())
+
+
+# Grow the session connection pool so parallel requests can share it. A pool
+# that is already large enough is kept, with its open connections
+def mount_pool(session: requests.Session, size):
+    if getattr(session.get_adapter(API_URL), "_pool_maxsize", 0) >= size:
+        return
+    adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+# Process-wide session, created on first use: its kept-alive connections are
+# reused by every query, thread and Streamlit rerun instead of paying a new
+# TCP+TLS handshake each time
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers.update(
+                {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+            )
+            mount_pool(session, SESSION_POOL_SIZE)
+            _session = session
+        return _session
+
+
+# Close the process-wide session; the next get_session call opens a new one
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+# Memoized: there are only a few hundred edition/type/rarity/color combinations
+@lru_cache(maxsize=None)
 def add_icons(edition, card_type, rarity, color):
     icons = []
 
@@ -42,41 +331,114 @@ def add_icons(edition, card_type, rarity, color):
     return " ".join(icons)
 
 
-def get_cards(edition, types, rarity, colours, session: requests.Session):
-    url = "https://api.splinterlands.com/cards/get_details"
+# Positions in the catalog of the splinterlands cards with each edition,
+# type, rarity and color, built once per catalog
+def build_catalog_index(all_cards):
+    index = {
+        "editions": defaultdict(set),
+        "type": defaultdict(set),
+        "rarity": defaultdict(set),
+        "color": defaultdict(set),
+    }
+    for position, card in enumerate(all_cards):
+        if card["game_type"] != "splinterlands":
+            continue
+        for key, positions in index.items():
+            positions[card[key]].add(position)
+    return index
+
+
+# The index of the cached catalog is built once, under the catalog lock, so
+# it always matches the cards it was built from; any other catalog gets a
+# fresh index
+def get_catalog_index(all_cards):
+    with _catalog_lock:
+        if _catalog["cards"] is all_cards:
+            if _catalog["index"] is None:
+                _catalog["index"] = build_catalog_index(all_cards)
+            return _catalog["index"]
+    return build_catalog_index(all_cards)
+
+
+def get_positions(positions_by_value, values):
+    return set().union(*(positions_by_value.get(value, ()) for value in values))
+
+
+def select_cards(all_cards, edition, types, rarity, colours):
+    index = get_catalog_index(all_cards)
+
+    positions = get_positions(index["editions"], edition)
+    positions &= get_positions(index["type"], types)
+    positions &= get_positions(index["rarity"], rarity)
+    if colours:
+        positions &= get_positions(index["color"], colours)
+
     cards_list = []
-    all_cards = get_response(url, session)
-    for card in all_cards:
-        if card["game_type"] == "splinterlands" and card["editions"] in edition:
-            if card["type"] not in types:
-                continue
-            if card["rarity"] not in rarity:
-                continue
-            if colours and card["color"] not in colours:
-                continue
-
-            icons = add_icons(card["editions"], card["type"], card["rarity"], card["color"])
-            cards_list.append(
-                {
-                    "id": card["id"],
-                    "name": card["name"],
-                    "icons": icons
-                }
-            )
+    for position in sorted(positions):
+        card = all_cards[position]
+        icons = add_icons(card["editions"], card["type"], card["rarity"], card["color"])
+        cards_list.append(
+            {
+                "id": card["id"],
+                "name": card["name"],
+                "icons": icons
+            }
+        )
     return cards_list
 
 
-def get_selling_prices(cards, foil, bcx, session: requests.Session):
-    url = "https://api.splinterlands.com/market/for_sale_grouped"
-    cards_on_market = get_response(url, session)
+# Return the card catalog from memory or disk, or None if it is stale
+def get_cached_catalog(ttl=CATALOG_TTL):
+    with _catalog_lock:
+        if _catalog["cards"] is None or time.time() - _catalog["loaded_at"] > ttl:
+            all_cards, fetched_at = read_json_cache(CATALOG_CACHE_FILE, ttl)
+            if all_cards is None:
+                return None
+            _catalog["cards"] = all_cards
+            _catalog["loaded_at"] = fetched_at
+            _catalog["index"] = None
+        return _catalog["cards"]
+
+
+def store_catalog(all_cards):
+    with _catalog_lock:
+        write_json_cache(CATALOG_CACHE_FILE, all_cards)
+        _catalog["cards"] = all_cards
+        _catalog["loaded_at"] = time.time()
+        _catalog["index"] = None
+
+
+def get_catalog(session: requests.Session, ttl=CATALOG_TTL, cancel=None):
+    all_cards = get_cached_catalog(ttl)
+    if all_cards is None:
+        all_cards = get_response(CARDS_URL, session, cancel)
+        store_catalog(all_cards)
+    return all_cards
+
 
+def invalidate_catalog():
+    with _catalog_lock:
+        _catalog["cards"] = None
+        _catalog["loaded_at"] = 0
+        _catalog["index"] = None
+        remove_cache(CATALOG_CACHE_FILE)
+
+
+def get_cards(edition, types, rarity, colours, session: requests.Session, cancel=None):
+    all_cards = get_catalog(session, cancel=cancel)
+    return select_cards(all_cards, edition, types, rarity, colours)
+
+
+def select_selling_prices(cards_on_market, cards, foil, bcx):
     card_ids = {
         card["id"] for card in cards
     }  # create a set with all the card ids we are interested in
 
     cards_list = []
+    rows_parsed = 0
 
     for card in cards_on_market:
+        rows_parsed += 1
         card_id = card["card_detail_id"]
         if card_id in card_ids and card["foil"] == foil:
             if card["foil"] == 0 or card["foil"] == 1:
@@ -84,18 +446,102 @@ def get_selling_prices(cards, foil, bcx, session: requests.Session):
             else:
                 cards_list.append({"id": card_id, "price": card["low_price_bcx"]})
 
+    add_stat("rows parsed", rows_parsed)
+    add_stat("rows kept", len(cards_list))
     return cards_list
 
 
-def get_valid_active_rentals(active_rentals, past_days, foil, bcx):
-    valid_active_rentals = []
-    for rental in active_rentals:
-        rental_time = rental["rental_date"]
-        rental_time_formatted = datetime.strptime(rental_time, "%Y-%m-%dT%H:%M:%S.%fZ")
+def store_market(listings):
+    with _market_lock:
+        _market["listings"] = listings
+        _market["fetched_at"] = time.time()
+        _market["refreshing"] = False
+
+
+def refresh_market_in_background():
+    try:
+        store_market(get_response(MARKET_URL, get_session()))
+    except Exception as e:
+        logger.error(f"Market snapshot refresh failed: {e}")
+        with _market_lock:
+            _market["refreshing"] = False
+
+
+# Return the market snapshot if it is still usable, or None
+def get_cached_market(ttl=MARKET_TTL, stale_ttl=MARKET_STALE_TTL):
+    with _market_lock:
+        listings = _market["listings"]
+        if listings is None:
+            return None
+
+        age = time.time() - _market["fetched_at"]
+        if age <= ttl:
+            return listings
+        if age > stale_ttl:
+            return None
+
+        if not _market["refreshing"]:
+            _market["refreshing"] = True
+            threading.Thread(target=refresh_market_in_background, daemon=True).start()
+        return listings
+
+
+def invalidate_market():
+    with _market_lock:
+        _market["listings"] = None
+        _market["fetched_at"] = 0
+
+
+# Age in seconds of the market snapshot, None if nothing was fetched yet
+def get_market_age():
+    with _market_lock:
+        if _market["listings"] is None:
+            return None
+        return time.time() - _market["fetched_at"]
 
-        if rental_time_formatted < past_days:
-            continue
 
+def get_market(
+    session: requests.Session, ttl=MARKET_TTL, stale_ttl=MARKET_STALE_TTL, cancel=None
+):
+    listings = get_cached_market(ttl, stale_ttl)
+    if listings is None:
+        listings = get_response(MARKET_URL, session, cancel)
+        store_market(listings)
+    return listings
+
+
+# With stream=True and no usable market snapshot, only the matching listings
+# are kept while the response is parsed, instead of the whole market
+def get_selling_prices(
+    cards, foil, bcx, session: requests.Session, stream=False, cancel=None
+):
+    if stream and get_cached_market() is None:
+        cards_on_market = stream_response_items(MARKET_URL, session, cancel)
+    else:
+        cards_on_market = get_market(session, cancel=cancel)
+    return select_selling_prices(cards_on_market, cards, foil, bcx)
+
+
+RENTAL_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+RENTAL_LENGTHS = (0, 1, 2)  # long, medium, short
+
+
+# rental_date strings are zero padded, so their first 19 characters
+# (YYYY-MM-DDTHH:MM:SS) sort like the dates themselves: only rentals made in
+# the same second as past_days need to be parsed
+def is_recent_rental(rental_time, past_days, past_days_prefix):
+    rental_time_prefix = rental_time[:19]
+    if rental_time_prefix != past_days_prefix:
+        return rental_time_prefix > past_days_prefix
+    return datetime.strptime(rental_time, RENTAL_DATE_FORMAT) >= past_days
+
+
+def get_valid_rental_columns(active_rentals, past_days, foil, bcx):
+    past_days_prefix = past_days.strftime("%Y-%m-%dT%H:%M:%S")
+
+    valid_active_rentals = RentalColumns()
+    for rental in active_rentals:
         if rental["rental_type"] != "season":
             continue
 
@@ -108,36 +554,99 @@ def get_valid_active_rentals(active_rentals, past_days, foil, bcx):
         if rental["payment_currency"] != "DEC":
             continue
 
+        if not is_recent_rental(rental["rental_date"], past_days, past_days_prefix):
+            continue
+
         valid_active_rentals.append(
-            {
-                "rental_price": float(rental["buy_price"]),
-                "rental_days": rental["rental_days"],
-                "card_detail_id": rental["card_detail_id"],
-            }
+            rental["card_detail_id"], rental["rental_days"], float(rental["buy_price"])
         )
 
+    add_stat("rows parsed", len(active_rentals))
+    add_stat("rows kept", len(valid_active_rentals))
     return valid_active_rentals
 
 
-def get_active_rentals(cards, foil, bcx, session: requests.Session):
+def get_valid_active_rentals(active_rentals, past_days, foil, bcx):
+    return get_valid_rental_columns(active_rentals, past_days, foil, bcx).to_dicts()
+
+
+def get_past_days():
     today = datetime.now()
-    past_days = today - timedelta(days=30)
-
-    card_rentals = []
-    for card in cards:
-        url = f"https://api.splinterlands.com/market/active_rentals?card_detail_id={card['id']}"
-        active_rentals = get_response(url, session)
-        valid_active_rentals = get_valid_active_rentals(
-            active_rentals, past_days, foil, bcx
-        )
-        card_rentals.append(
-            {
-                "name": card["name"],
-                "id": card["id"],
-                "active_rentals": valid_active_rentals,
-                "icons": card["icons"]
-            }
-        )
+    return today - timedelta(days=30)
+
+
+def build_card_rentals(card, active_rentals, past_days, foil, bcx):
+    valid_active_rentals = get_valid_rental_columns(
+        active_rentals, past_days, foil, bcx
+    )
+    return CardRentals(card["id"], card["name"], card["icons"], valid_active_rentals)
+
+
+# Read the valid rentals of a card from the local store, refreshing it first
+# if the stored copy is stale
+def get_stored_card_rentals(
+    card, past_days, foil, bcx, session: requests.Session, store, cancel=None
+):
+    if is_stale(store, card["id"]):
+        active_rentals = get_response(RENTALS_URL.format(card["id"]), session, cancel)
+        store_card_rentals(store, card["id"], active_rentals)
+
+    past_days_prefix = past_days.strftime("%Y-%m-%dT%H:%M:%S")
+    rows = query_rentals(store, card["id"], past_days_prefix, foil, bcx)
+    valid_active_rentals = RentalColumns()
+    for rental_date, rental_days, rental_price in rows:
+        if is_recent_rental(rental_date, past_days, past_days_prefix):
+            valid_active_rentals.append(card["id"], rental_days, rental_price)
+
+    add_stat("rows parsed", len(rows))
+    add_stat("rows kept", len(valid_active_rentals))
+
+    return CardRentals(card["id"], card["name"], card["icons"], valid_active_rentals)
+
+
+def get_card_rentals(
+    card, past_days, foil, bcx, session: requests.Session, store=None, cancel=None
+):
+    check_cancelled(cancel)
+    if store is not None:
+        return get_stored_card_rentals(card, past_days, foil, bcx, session, store, cancel)
+
+    active_rentals = get_response(RENTALS_URL.format(card["id"]), session, cancel)
+    return build_card_rentals(card, active_rentals, past_days, foil, bcx)
+
+
+# With workers > 1 the per-card requests are sent in parallel over a shared
+# connection pool; results keep the same order as cards. With a rentals store
+# (see rentals_store.open_store) only stale cards are fetched. Setting cancel
+# stops sending requests and raises QueryCancelledError
+def get_active_rentals(
+    cards, foil, bcx, session: requests.Session, workers=1, store=None, cancel=None
+):
+    past_days = get_past_days()
+
+    if workers <= 1:
+        return [
+            get_card_rentals(card, past_days, foil, bcx, session, store, cancel)
+            for card in cards
+        ]
+
+    mount_pool(session, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                copy_context().run,
+                get_card_rentals,
+                card,
+                past_days,
+                foil,
+                bcx,
+                session,
+                store,
+                cancel,
+            )
+            for card in cards
+        ]
+        card_rentals = [future.result() for future in futures]
 
     return card_rentals
 
@@ -172,66 +681,448 @@ def get_rental_prices(values):
     ]
 
 
-def get_sorted_result(cards_list, length):
-    result = []
+# Bucket index of each rental: 0 long (>= 14 days), 1 medium (11-13), 2 short
+def get_length_buckets(rental_days):
+    return np.where(rental_days >= 14, 0, np.where(rental_days >= 11, 1, 2))
 
-    for card in cards_list:
-        name = card["name"]
-        icons = card["icons"]
-        rental_price = card["active_rentals"][length][0] if card["active_rentals"] else 0
-        selling_price = card.get("price", None)
-
-        if selling_price and rental_price:
-            if length == 0: 
-                roi = (rental_price * 36.5) / selling_price
-            elif length == 1:
-                roi = (rental_price * 36.5 * 4 / 5) / selling_price
-            else:
-                roi = (rental_price * 36.5 * 3 / 5) / selling_price
-            roi = round(roi, 2)
+
+# Concatenate the valid rentals of every card into flat NumPy arrays
+def flatten_rentals(card_rentals):
+    rentals = RentalColumns()
+    for card in card_rentals:
+        rentals.extend(card.rentals)
+    return rentals.to_numpy()
+
+
+# Same result as get_rental_prices for every card at once, computed with one
+# sort over all rentals: returns {card id: [[price, count] per length bucket]}
+def get_batch_rental_prices(card_ids, rental_days, rental_prices):
+    unique_ids, card_index = np.unique(card_ids, return_inverse=True)
+    group = card_index * 3 + get_length_buckets(rental_days)
+
+    order = np.lexsort((rental_prices, group))
+    sorted_prices = rental_prices[order]
+    groups, starts, counts = np.unique(group[order], return_index=True, return_counts=True)
+
+    # 70th percentile with linear interpolation, as np.percentile does
+    position = (counts - 1) * 0.7
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    t = position - lower
+    a = sorted_prices[starts + lower]
+    b = sorted_prices[starts + upper]
+    diff = b - a
+    percentiles = np.round(np.where(t >= 0.5, b - diff * (1 - t), a + diff * t), 3)
+
+    result = {int(card_id): [[0, 0], [0, 0], [0, 0]] for card_id in unique_ids}
+    for g, percentile, count in zip(groups.tolist(), percentiles, counts.tolist()):
+        result[int(unique_ids[g // 3])][g % 3] = [percentile, count]
+
+    return result
+
+
+# Add rentals, one at a time, to {card id: [QuantileSketch per length
+# bucket]}: a compact alternative to keeping every rental price, e.g. when
+# monitoring the whole market across refreshes. Returns the updated sketches
+def update_rental_sketches(sketches, card_ids, rental_days, rental_prices):
+    buckets = get_length_buckets(np.asarray(rental_days))
+    for card_id, bucket, rental_price in zip(card_ids, buckets.tolist(), rental_prices):
+        if card_id not in sketches:
+            sketches[card_id] = [QuantileSketch() for _ in RENTAL_LENGTHS]
+        sketches[card_id][bucket].update(rental_price)
+    return sketches
+
+
+# Merge the rental sketches of other (another worker or refresh) into sketches
+def merge_rental_sketches(sketches, other):
+    for card_id, card_sketches in other.items():
+        if card_id not in sketches:
+            sketches[card_id] = [QuantileSketch() for _ in RENTAL_LENGTHS]
+        for sketch, other_sketch in zip(sketches[card_id], card_sketches):
+            sketch.merge(other_sketch)
+    return sketches
+
+
+# Same format as get_batch_rental_prices, from rental sketches. Equal to it
+# for buckets of at most SKETCH_K rentals, see QuantileSketch for the error
+# bounds past that
+def get_sketch_rental_prices(sketches):
+    return {
+        card_id: [
+            [np.round(sketch.percentile(70), 3), sketch.count] if sketch.count else [0, 0]
+            for sketch in card_sketches
+        ]
+        for card_id, card_sketches in sketches.items()
+    }
+
+
+# Rental prices of flattened rentals through get_batch_rental_prices or,
+# with sketch=True, through rental sketches
+def aggregate_rental_prices(card_ids, rental_days, rental_prices, sketch=False):
+    if not sketch:
+        return get_batch_rental_prices(card_ids, rental_days, rental_prices)
+    sketches = update_rental_sketches(
+        {}, card_ids.tolist(), rental_days, rental_prices.tolist()
+    )
+    return get_sketch_rental_prices(sketches)
+
+
+def get_roi(rental_price, selling_price, length):
+    if selling_price and rental_price:
+        if length == 0: 
+            roi = (rental_price * 36.5) / selling_price
+        elif length == 1:
+            roi = (rental_price * 36.5 * 4 / 5) / selling_price
         else:
-            roi = "N/A"
+            roi = (rental_price * 36.5 * 3 / 5) / selling_price
+        return round(roi, 2)
+    return "N/A"
 
-        result.append(
-            {
-                "name": name,
-                "roi": roi,
-                "avg rental price": rental_price,
-                "cards rented": card["active_rentals"][length][1],
-                "icons": icons,
-            }
-        )
 
-    result = sorted(
+def get_result_row(name, icons, rental_prices, selling_price, length):
+    rental_price = rental_prices[length][0] if rental_prices else 0
+    return {
+        "name": name,
+        "roi": get_roi(rental_price, selling_price, length),
+        "avg rental price": rental_price,
+        "cards rented": rental_prices[length][1],
+        "icons": icons,
+    }
+
+
+def sort_result(result):
+    return sorted(
         result,
         key=lambda x: x["roi"] if x["roi"] != "N/A" else -float("inf"),
         reverse=True,
     )
 
-    return result
+
+def get_sorted_result(cards_list, length):
+    result = [
+        get_result_row(
+            card["name"],
+            card["icons"],
+            card["active_rentals"],
+            card.get("price", None),
+            length,
+        )
+        for card in cards_list
+    ]
+    return sort_result(result)
 
 
-def check_rental_roi(
-    edition, types, rarity, foil, bcx, colours, length, session: requests.Session
+# Join selling prices and aggregated rental prices by card id. Cards on the
+# market come first, in market order, as the previous dict merge did
+def join_card_results(cards, card_selling_prices, rental_prices):
+    selling_prices = {card["id"]: card["price"] for card in card_selling_prices}
+    cards_by_id = {card["id"]: card for card in cards}
+
+    ordered_ids = [card_id for card_id in selling_prices if card_id in cards_by_id]
+    ordered_ids += [card["id"] for card in cards if card["id"] not in selling_prices]
+
+    return [
+        CardResult(
+            card_id,
+            cards_by_id[card_id]["name"],
+            cards_by_id[card_id]["icons"],
+            selling_prices.get(card_id),
+            rental_prices.get(card_id, [[0, 0], [0, 0], [0, 0]]),
+        )
+        for card_id in ordered_ids
+    ]
+
+
+def get_card_results(card_selling_prices, card_rentals, sketch=False):
+    rental_prices = aggregate_rental_prices(*flatten_rentals(card_rentals), sketch)
+    cards = [
+        {"id": card.id, "name": card.name, "icons": card.icons} for card in card_rentals
+    ]
+    return join_card_results(cards, card_selling_prices, rental_prices)
+
+
+def get_card_result(card_rentals, selling_prices, sketch=False):
+    rental_prices = aggregate_rental_prices(*card_rentals.rentals.to_numpy(), sketch)
+    return CardResult(
+        card_rentals.id,
+        card_rentals.name,
+        card_rentals.icons,
+        selling_prices.get(card_rentals.id),
+        rental_prices.get(card_rentals.id, [[0, 0], [0, 0], [0, 0]]),
+    )
+
+
+# Result of a card whose rentals were not fetched in time
+def get_unfinished_result(card, selling_prices):
+    return CardResult(
+        card["id"],
+        card["name"],
+        card["icons"],
+        selling_prices.get(card["id"]),
+        [[0, 0], [0, 0], [0, 0]],
+        complete=False,
+    )
+
+
+# Run fn(*args) in a thread and wait for it at most timeout seconds (None: no
+# limit). On timeout cancel is set, so fn's requests stop at their next
+# attempt, and TimeoutError is raised
+def call_with_timeout(fn, timeout, cancel, *args):
+    if timeout is None:
+        return fn(*args)
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = executor.submit(copy_context().run, fn, *args)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            cancel.set()
+            raise
+    finally:
+        executor.shutdown(wait=False)
+
+
+# Seconds left before deadline (a time.monotonic() value), None for no limit
+def get_remaining_time(deadline):
+    return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+
+# Yield the CardResult of each card as soon as its rentals are fetched, in
+# completion order. After timeout seconds, counted from the call and
+# including the selling prices fetch, the remaining requests are
+# cancelled, then TimeoutError is raised or, with partial=True, the
+# unfinished cards are yielded with complete=False. Setting cancel, a
+# per-query threading.Event, cancels the query; it is set once the generator
+# is done or closed early, so the remaining requests stop
+def iter_card_results(
+    cards,
+    foil,
+    bcx,
+    session: requests.Session,
+    workers=1,
+    stream_market=False,
+    store=None,
+    timeout=None,
+    partial=False,
+    cancel=None,
 ):
+    if cancel is None:
+        cancel = threading.Event()
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    try:
+        with phase("get_selling_prices"):
+            card_selling_prices = call_with_timeout(
+                get_selling_prices,
+                timeout,
+                cancel,
+                cards,
+                foil,
+                bcx,
+                session,
+                stream_market,
+                cancel,
+            )
+    except TimeoutError:
+        if not partial:
+            raise
+        for card in cards:
+            yield get_unfinished_result(card, {})
+        return
+    selling_prices = {card["id"]: card["price"] for card in card_selling_prices}
+    past_days = get_past_days()
+
+    if workers > 1:
+        mount_pool(session, workers)
+    executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+    try:
+        futures = {
+            executor.submit(
+                copy_context().run,
+                get_card_rentals,
+                card,
+                past_days,
+                foil,
+                bcx,
+                session,
+                store,
+                cancel,
+            ): card
+            for card in cards
+        }
+        finished = set()
+        try:
+            completed = as_completed(futures, timeout=get_remaining_time(deadline))
+            while True:
+                # Only the wait is timed, not the caller's work between cards
+                with phase("get_active_rentals"):
+                    future = next(completed, None)
+                if future is None:
+                    break
+                finished.add(future)
+                with phase("aggregation"):
+                    card_result = get_card_result(future.result(), selling_prices)
+                yield card_result
+        except TimeoutError:
+            cancel.set()
+            if not partial:
+                raise
+            for future, card in futures.items():
+                if future not in finished:
+                    yield get_unfinished_result(card, selling_prices)
+    finally:
+        cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Streaming check_rental_roi: yields the result row of each card as soon as
+# it is ready, unsorted
+def iter_rental_roi(
+    edition,
+    types,
+    rarity,
+    foil,
+    bcx,
+    colours,
+    length,
+    session: requests.Session = None,
+    workers=1,
+    stream_market=False,
+    store=None,
+):
+    session = session or get_session()
     cards = get_cards(edition, types, rarity, colours, session)
+    for card in iter_card_results(cards, foil, bcx, session, workers, stream_market, store):
+        yield get_result_row(card.name, card.icons, card.rental_prices, card.price, length)
 
-    card_selling_prices = get_selling_prices(cards, foil, bcx, session)
 
-    card_rentals = get_active_rentals(cards, foil, bcx, session)
+def get_result_rows(card_results, length):
+    result = [
+        get_result_row(card.name, card.icons, card.rental_prices, card.price, length)
+        for card in card_results
+    ]
+    return sort_result(result)
 
-    for card in card_rentals:
-        updated_price = get_rental_prices(card["active_rentals"])
-        card["active_rentals"] = updated_price
 
-    merged_cards_dict = defaultdict(dict)
+# Like get_result_rows, with a "status" of "done" or "not fetched" per card;
+# cards not fetched have no rental data and an "N/A" ROI
+def get_partial_result_rows(card_results, length):
+    result = []
+    for card in card_results:
+        row = get_result_row(card.name, card.icons, card.rental_prices, card.price, length)
+        if card.complete:
+            row["status"] = "done"
+        else:
+            row["roi"] = "N/A"
+            row["status"] = "not fetched"
+        result.append(row)
+    return sort_result(result)
 
-    for d in card_selling_prices + card_rentals:
-        merged_cards_dict[d["id"]].update(d)
 
-    merged_cards_list = list(merged_cards_dict.values())
+# Per-card figures of a run, in the format roi_history.save_snapshot expects
+def get_snapshot_rows(card_results, length):
+    rows = []
+    for card in card_results:
+        rental_price = card.rental_prices[length][0]
+        rows.append(
+            {
+                "id": card.id,
+                "name": card.name,
+                "price": card.price,
+                "rental_price": rental_price,
+                "cards_rented": card.rental_prices[length][1],
+                "roi": get_roi(rental_price, card.price, length),
+            }
+        )
+    return rows
+
+
+# Aggregate rental prices, join them with the selling prices and sort by ROI
+def merge_results(card_selling_prices, card_rentals, length):
+    card_results = get_card_results(card_selling_prices, card_rentals)
+    return get_result_rows(card_results, length)
+
+
+# Fetch the cards matching the filters and join their selling and rental
+# prices: the result covers every rental length
+def get_query_card_results(
+    edition,
+    types,
+    rarity,
+    foil,
+    bcx,
+    colours,
+    session: requests.Session,
+    workers=1,
+    stream_market=False,
+    store=None,
+    cancel=None,
+    sketch=False,
+):
+    with phase("get_cards"):
+        cards = get_cards(edition, types, rarity, colours, session, cancel)
+
+    with phase("get_selling_prices"):
+        card_selling_prices = get_selling_prices(
+            cards, foil, bcx, session, stream_market, cancel
+        )
 
-    final_result = get_sorted_result(merged_cards_list, length)
+    with phase("get_active_rentals"):
+        card_rentals = get_active_rentals(
+            cards, foil, bcx, session, workers, store, cancel
+        )
+
+    with phase("aggregation"):
+        return get_card_results(card_selling_prices, card_rentals, sketch)
+
+
+# Keep the figures of a run (see roi_history.open_history)
+def save_history(history, card_results, edition, types, rarity, foil, bcx, colours, length):
+    query_key = get_query_key(edition, types, rarity, foil, bcx, colours, length)
+    save_snapshot(
+        history, query_key, foil, bcx, length, get_snapshot_rows(card_results, length)
+    )
+
+
+def check_rental_roi(
+    edition,
+    types,
+    rarity,
+    foil,
+    bcx,
+    colours,
+    length,
+    session: requests.Session = None,
+    workers=1,
+    stream_market=False,
+    store=None,
+    history=None,
+    cancel=None,
+    sketch=False,
+):
+    session = session or get_session()
+    card_results = get_query_card_results(
+        edition,
+        types,
+        rarity,
+        foil,
+        bcx,
+        colours,
+        session,
+        workers,
+        stream_market,
+        store,
+        cancel,
+        sketch,
+    )
+
+    if history is not None:
+        save_history(
+            history, card_results, edition, types, rarity, foil, bcx, colours, length
+        )
+
+    with phase("sort"):
+        final_result = get_result_rows(card_results, length)
 
     for result in final_result:
         print(result)
@@ -239,6 +1130,324 @@ def check_rental_roi(
     return final_result
 
 
+# check_rental_roi giving up after timeout seconds (None: no limit): returns
+# the rows of get_partial_result_rows and whether every card was fetched.
+# Raises TimeoutError if even the card catalog could not be fetched in time
+def check_rental_roi_partial(
+    edition,
+    types,
+    rarity,
+    foil,
+    bcx,
+    colours,
+    length,
+    session: requests.Session = None,
+    timeout=None,
+    workers=1,
+    stream_market=False,
+    store=None,
+):
+    session = session or get_session()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    cancel = threading.Event()
+    cards = call_with_timeout(
+        get_cards, timeout, cancel, edition, types, rarity, colours, session, cancel
+    )
+    card_results = list(
+        iter_card_results(
+            cards,
+            foil,
+            bcx,
+            session,
+            workers,
+            stream_market,
+            store,
+            get_remaining_time(deadline),
+            True,
+            cancel,
+        )
+    )
+    complete = all(card.complete for card in card_results)
+    return get_partial_result_rows(card_results, length), complete
+
+
+# check_rental_roi returning (results, QueryStats) with per-phase wall times,
+# request and byte counts and rows parsed/kept. With profile=True the stats
+# also hold a cProfile of the calling thread (see QueryStats.profile_report)
+def check_rental_roi_with_stats(*args, profile=False, **kwargs):
+    with collect_stats(profile) as stats:
+        final_result = check_rental_roi(*args, **kwargs)
+    return final_result, stats
+
+
+# Same as check_rental_roi for the long, medium and short rental lengths at
+# once, from a single fetch: returns one result list per length (0, 1, 2)
+def check_rental_roi_all_lengths(
+    edition,
+    types,
+    rarity,
+    foil,
+    bcx,
+    colours,
+    session: requests.Session = None,
+    workers=1,
+    stream_market=False,
+    store=None,
+    history=None,
+    cancel=None,
+    sketch=False,
+):
+    session = session or get_session()
+    card_results = get_query_card_results(
+        edition,
+        types,
+        rarity,
+        foil,
+        bcx,
+        colours,
+        session,
+        workers,
+        stream_market,
+        store,
+        cancel,
+        sketch,
+    )
+
+    final_results = []
+    for length in RENTAL_LENGTHS:
+        if history is not None:
+            save_history(
+                history, card_results, edition, types, rarity, foil, bcx, colours, length
+            )
+        final_results.append(get_result_rows(card_results, length))
+
+    return final_results
+
+
+# Valid rentals of a card for every foil and BCX: the same filters as
+# get_valid_rental_columns except foil and xp, which are kept as columns
+def get_card_scenario_rentals(card, past_days, session: requests.Session):
+    active_rentals = get_response(RENTALS_URL.format(card["id"]), session)
+    past_days_prefix = past_days.strftime("%Y-%m-%dT%H:%M:%S")
+
+    foils, xps, rentals = [], [], RentalColumns()
+    for rental in active_rentals:
+        if rental["rental_type"] != "season":
+            continue
+
+        if rental["payment_currency"] != "DEC":
+            continue
+
+        if not is_recent_rental(rental["rental_date"], past_days, past_days_prefix):
+            continue
+
+        foils.append(rental["foil"])
+        xps.append(rental["xp"])
+        rentals.append(card["id"], rental["rental_days"], float(rental["buy_price"]))
+
+    return foils, xps, rentals
+
+
+# Vectorized get_roi: NaN where the ROI can't be computed
+def get_roi_matrix(rental_prices, selling_prices, length):
+    if length == 0:
+        yearly_rent = rental_prices * 36.5
+    elif length == 1:
+        yearly_rent = rental_prices * 36.5 * 4 / 5
+    else:
+        yearly_rent = rental_prices * 36.5 * 3 / 5
+
+    valid = (rental_prices != 0) & (selling_prices != 0) & ~np.isnan(selling_prices)
+    roi = np.full(rental_prices.shape, np.nan)
+    np.divide(yearly_rent, selling_prices, out=roi, where=valid)
+    return np.round(roi, 2)
+
+
+# Fetch the rentals of every card once and return flat (card id, days, price,
+# foil, xp) arrays of its season DEC rentals of the last 30 days
+def get_scenario_rentals(cards, session: requests.Session, workers=1):
+    past_days = get_past_days()
+
+    if workers > 1:
+        mount_pool(session, workers)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = [
+            executor.submit(
+                copy_context().run, get_card_scenario_rentals, card, past_days, session
+            )
+            for card in cards
+        ]
+        card_rentals = [future.result() for future in futures]
+
+    rentals = RentalColumns()
+    rental_foils, rental_xps = [], []
+    for foils_column, xps_column, card_rental_columns in card_rentals:
+        rental_foils += foils_column
+        rental_xps += xps_column
+        rentals.extend(card_rental_columns)
+    card_ids, rental_days, rental_prices = rentals.to_numpy()
+
+    return (
+        card_ids,
+        rental_days,
+        rental_prices,
+        np.asarray(rental_foils, dtype=np.int64),
+        np.asarray(rental_xps, dtype=np.int64),
+    )
+
+
+# get_batch_rental_prices of the get_scenario_rentals rentals of one foil and
+# BCX, optionally only of the cards with the given ids
+def get_scenario_rental_prices(scenario_rentals, foil, bcx, card_ids=None):
+    rental_card_ids, rental_days, rental_prices, rental_foils, rental_xps = scenario_rentals
+    scenario = (rental_foils == foil) & (rental_xps == bcx)
+    if card_ids is not None:
+        scenario &= np.isin(rental_card_ids, card_ids)
+    return get_batch_rental_prices(
+        rental_card_ids[scenario], rental_days[scenario], rental_prices[scenario]
+    )
+
+
+# ROI of every card for every foil x BCX combination, from one catalog, one
+# market and one active_rentals fetch per card. Returns the cards and
+# (cards, foils, bcxs) arrays of market price, rental price, cards rented
+# and ROI, NaN where there is no market price or ROI
+def check_rental_roi_matrix(
+    edition,
+    types,
+    rarity,
+    colours,
+    foils,
+    bcxs,
+    length,
+    session: requests.Session = None,
+    workers=1,
+):
+    session = session or get_session()
+    cards = get_cards(edition, types, rarity, colours, session)
+    cards_on_market = get_market(session)
+    scenario_rentals = get_scenario_rentals(cards, session, workers)
+
+    shape = (len(cards), len(foils), len(bcxs))
+    prices = np.full(shape, np.nan)
+    avg_rental_prices = np.zeros(shape)
+    cards_rented = np.zeros(shape, dtype=np.int64)
+    card_index = {card["id"]: i for i, card in enumerate(cards)}
+
+    for f, foil in enumerate(foils):
+        for b, bcx in enumerate(bcxs):
+            for card in select_selling_prices(cards_on_market, cards, foil, bcx):
+                prices[card_index[card["id"]], f, b] = card["price"]
+
+            scenario_prices = get_scenario_rental_prices(scenario_rentals, foil, bcx)
+            for card_id, card_rental_prices in scenario_prices.items():
+                rental_price, count = card_rental_prices[length]
+                avg_rental_prices[card_index[card_id], f, b] = rental_price
+                cards_rented[card_index[card_id], f, b] = count
+
+    return {
+        "cards": cards,
+        "foils": list(foils),
+        "bcxs": list(bcxs),
+        "price": prices,
+        "avg rental price": avg_rental_prices,
+        "cards rented": cards_rented,
+        "roi": get_roi_matrix(avg_rental_prices, prices, length),
+    }
+
+
+# Evaluate many queries over one shared fetch: the catalog, the market and
+# the rentals of the union of the queries' cards are fetched once. Each query
+# is a dict with the check_rental_roi arguments edition, types, rarity, foil,
+# bcx, colours and length; returns one result list per query
+def check_rental_roi_batch(queries, session: requests.Session = None, workers=1):
+    session = session or get_session()
+    queries_cards = [
+        get_cards(
+            query["edition"], query["types"], query["rarity"], query.get("colours", []), session
+        )
+        for query in queries
+    ]
+    cards_on_market = get_market(session)
+
+    all_cards = {card["id"]: card for cards in queries_cards for card in cards}
+    scenario_rentals = get_scenario_rentals(list(all_cards.values()), session, workers)
+
+    final_results = []
+    for query, cards in zip(queries, queries_cards):
+        foil, bcx = query["foil"], query["bcx"]
+        rental_prices_by_card = get_scenario_rental_prices(
+            scenario_rentals, foil, bcx, [card["id"] for card in cards]
+        )
+        card_selling_prices = select_selling_prices(cards_on_market, cards, foil, bcx)
+        card_results = join_card_results(cards, card_selling_prices, rental_prices_by_card)
+        final_results.append(get_result_rows(card_results, query["length"]))
+
+    return final_results
+
+
+# Rental prices of a shard of cards for each (foil, bcx) scenario, as
+# {(foil, bcx): {card id: [[price, count] per length bucket]}}. Runs in a
+# check_rental_roi_sweep worker process, with that process' own session
+def get_shard_rental_prices(cards, scenarios, workers=1):
+    scenario_rentals = get_scenario_rentals(cards, get_session(), workers)
+    return {
+        (foil, bcx): get_scenario_rental_prices(scenario_rentals, foil, bcx)
+        for foil, bcx in scenarios
+    }
+
+
+# ROI of every card matching the filters for every foil x BCX, as one table
+# of result rows with their foil and bcx, sorted by ROI. Fetching, parsing,
+# filtering and aggregating the rentals is CPU bound for large sweeps, so
+# the cards are sharded across processes (default: one per CPU core), each
+# fetching its shard with workers threads. Worker processes are spawned, not
+# forked, as the caller may be running other threads (Streamlit, prefetcher)
+def check_rental_roi_sweep(
+    edition,
+    types,
+    rarity,
+    colours,
+    foils,
+    bcxs,
+    length,
+    session: requests.Session = None,
+    processes=None,
+    workers=4,
+):
+    session = session or get_session()
+    cards = get_cards(edition, types, rarity, colours, session)
+    cards_on_market = get_market(session)
+    scenarios = list(product(foils, bcxs))
+
+    processes = processes or os.cpu_count() or 1
+    shards = [cards[i::processes] for i in range(min(processes, len(cards)))]
+
+    rental_prices = {scenario: {} for scenario in scenarios}
+    with ProcessPoolExecutor(
+        max_workers=max(len(shards), 1), mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(get_shard_rental_prices, shard, scenarios, workers)
+            for shard in shards
+        ]
+        for future in as_completed(futures):
+            for scenario, shard_rental_prices in future.result().items():
+                rental_prices[scenario].update(shard_rental_prices)
+
+    result = []
+    for foil, bcx in scenarios:
+        card_selling_prices = select_selling_prices(cards_on_market, cards, foil, bcx)
+        card_results = join_card_results(
+            cards, card_selling_prices, rental_prices[(foil, bcx)]
+        )
+        result += [
+            {"foil": foil, "bcx": bcx, **row} for row in get_result_rows(card_results, length)
+        ]
+
+    return sort_result(result)
+
+
 def main():
     edition = ["14"]  # Conclave Arcana
     types = ["Monster"]  # "Summoner" and/or "Monster"
@@ -249,10 +1458,7 @@ def main():
     length = 0  # 0, 1 or 2
 
     try:
-        with requests.Session() as session:
-            result = check_rental_roi(
-                edition, types, rarity, foil, bcx, colours, length, session
-            )
+        result = check_rental_roi(edition, types, rarity, foil, bcx, colours, length)
     except (json.JSONDecodeError, KeyError) as e:
         logger.error(f"JSON decode error or missing key: {e}")
     except Exception as e:
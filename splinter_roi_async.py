@@ -0,0 +1,147 @@
+import asyncio
+import json
+import aiohttp
+from splinter_roi import (
+    MAX_RETRIES,
+    RETRY_STATUS_CODES,
+    RATE_LIMITED_STATUS_CODE,
+    REQUEST_TIMEOUT,
+    check_circuit,
+    record_success,
+    get_retry_delay,
+    get_request_error,
+    logger,
+    CARDS_URL,
+    MARKET_URL,
+    RENTALS_URL,
+    get_cached_catalog,
+    store_catalog,
+    select_cards,
+    get_cached_market,
+    store_market,
+    select_selling_prices,
+    get_past_days,
+    build_card_rentals,
+    merge_results,
+)
+
+
+# Requests currently being sent, by event loop and URL
+_in_flight = {}
+
+
+# Send request, get response, return decoded JSON response, retrying and
+# sharing the circuit breaker exactly like splinter_roi.send_request
+async def send_request_async(url, session: aiohttp.ClientSession):
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    check_circuit()
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        rate_limited = False
+        try:
+            async with session.get(url, allow_redirects=False, timeout=timeout) as response:
+                if response.status in RETRY_STATUS_CODES:
+                    retry_after = response.headers.get("Retry-After")
+                    rate_limited = response.status == RATE_LIMITED_STATUS_CODE
+                    error = f"status code {response.status}"
+                else:
+                    result = await response.json(content_type=None)
+                    record_success()
+                    return result
+        except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+            error = e
+
+        if attempt == MAX_RETRIES:
+            raise get_request_error(url, attempt + 1, error, rate_limited)
+
+        delay = get_retry_delay(attempt, retry_after)
+        logger.warning(f"Request to {url} failed ({error}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+# Concurrent callers asking for the same URL await a single request and
+# share its decoded response
+async def get_response_async(url, session: aiohttp.ClientSession):
+    key = (asyncio.get_running_loop(), url)
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(send_request_async(url, session))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+async def get_cards_async(edition, types, rarity, colours, session: aiohttp.ClientSession):
+    all_cards = get_cached_catalog()
+    if all_cards is None:
+        all_cards = await get_response_async(CARDS_URL, session)
+        store_catalog(all_cards)
+    return select_cards(all_cards, edition, types, rarity, colours)
+
+
+async def get_selling_prices_async(cards, foil, bcx, session: aiohttp.ClientSession):
+    cards_on_market = get_cached_market()
+    if cards_on_market is None:
+        cards_on_market = await get_response_async(MARKET_URL, session)
+        store_market(cards_on_market)
+    return select_selling_prices(cards_on_market, cards, foil, bcx)
+
+
+# At most `concurrency` active_rentals requests are in flight at once
+async def get_active_rentals_async(
+    cards, foil, bcx, session: aiohttp.ClientSession, concurrency=8
+):
+    past_days = get_past_days()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get_card_rentals(card):
+        async with semaphore:
+            active_rentals = await get_response_async(
+                RENTALS_URL.format(card["id"]), session
+            )
+        return build_card_rentals(card, active_rentals, past_days, foil, bcx)
+
+    return list(await asyncio.gather(*(get_card_rentals(card) for card in cards)))
+
+
+async def check_rental_roi_async(
+    edition,
+    types,
+    rarity,
+    foil,
+    bcx,
+    colours,
+    length,
+    session: aiohttp.ClientSession,
+    concurrency=8,
+):
+    cards = await get_cards_async(edition, types, rarity, colours, session)
+
+    card_selling_prices, card_rentals = await asyncio.gather(
+        get_selling_prices_async(cards, foil, bcx, session),
+        get_active_rentals_async(cards, foil, bcx, session, concurrency),
+    )
+
+    return merge_results(card_selling_prices, card_rentals, length)
+
+
+async def main():
+    edition = ["14"]  # Conclave Arcana
+    types = ["Monster"]  # "Summoner" and/or "Monster"
+    rarity = [1, 3]  # 1, 2, 3, and/or 4
+    foil = 0  # 0 rf, 1 gold, 2 gold arcane, 3 black, 4 black arcane
+    bcx = 1
+    colours = []
+    length = 0  # 0, 1 or 2
+
+    async with aiohttp.ClientSession() as session:
+        result = await check_rental_roi_async(
+            edition, types, rarity, foil, bcx, colours, length, session
+        )
+
+    for card in result:
+        print(card)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,12 +1,31 @@
 import streamlit as st
-import requests
 import json
+import os
+import threading
+import time
 import pandas as pd
 from io import BytesIO
-from splinter_roi import check_rental_roi
-from xlsxwriter import Workbook
+from concurrent.futures import TimeoutError
+from splinter_roi import (
+    RENTAL_LENGTHS,
+    get_cards,
+    iter_card_results,
+    get_partial_result_rows,
+    save_history,
+    invalidate_catalog,
+    get_market_age,
+    ApiUnavailableError,
+    get_session,
+    call_with_timeout,
+    get_remaining_time,
+)
+from rentals_store import open_store
+from instrumentation import collect_stats, phase
+from prefetch import start_prefetcher, get_prefetch_status
+from roi_history import open_history, get_query_key, get_query_roi_trend
+from datetime import datetime, timedelta
+from export import export_xlsx, get_roi_color
 from icons import edition_icons, card_type_icons, rarity_icons, color_icons
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 # For every new edition added, a new icon should also be added in icons.py
 # Mapping dictionaries
@@ -54,25 +73,46 @@ rental_length_mapping = {
     "Short": 2
 }
 
+# Number of parallel active_rentals requests per query
+RENTAL_WORKERS = 8
+
+# Seconds before a query is abandoned, and between partial results updates
+QUERY_TIMEOUT = 60
+PARTIAL_RESULTS_INTERVAL = 0.5
+
+# Editions whose rentals are kept fresh in the background. Set
+# SPLINTER_ROI_BACKGROUND_REFRESH=0 when a standalone prefetcher
+# (python prefetch.py) already refreshes them
+PREFETCH_EDITIONS = ["14", "17", "18"]
+BACKGROUND_REFRESH = os.environ.get("SPLINTER_ROI_BACKGROUND_REFRESH", "1") != "0"
+
+# Local rentals store shared by every session of this process
+@st.cache_resource
+def get_rentals_store():
+    return open_store()
+
+
+# One background refresher per process, started by the first session
+@st.cache_resource
+def start_background_refresh():
+    return start_prefetcher(PREFETCH_EDITIONS, get_rentals_store())
+
+
+def format_age(timestamp):
+    if timestamp is None:
+        return "never"
+    return f"{(time.time() - timestamp) / 60:.0f} min ago"
+
+
+# ROI history of every query run by this app
+@st.cache_resource
+def get_roi_history():
+    return open_history()
+
+
 # Function to apply conditional formatting
 def highlight_roi(val):
-    try:
-        val_float = float(val)
-    except (ValueError, TypeError):
-        # Se non convertibile, considera come NaN
-        return "background-color: tomato; color: black;"
-    if pd.isna(val_float):
-        return "background-color: tomato; color: black;"
-        
-    if val >= 30:
-        color = "lime"
-    elif val >= 20:
-        color = "gold"
-    elif val >= 10:
-        color = "orange"
-    else:
-        color = "tomato"
-    return f"background-color: {color}; color: black;"
+    return f"background-color: {get_roi_color(val)}; color: black;"
 
 
 def format_roi(x):
@@ -82,6 +122,183 @@ def format_roi(x):
         return "N/A"
 
 
+# Sorted results table of one rental length
+def get_results_df(data):
+    for d in data:
+        d["Card"] = f"{d['icons']} - {d['name']}"
+        if d.get("status") == "not fetched":
+            d["Card"] += " ⏳ (not fetched in time)"
+
+    df = pd.DataFrame(data)
+
+    # Rinomina colonne per visualizzazione
+    df = df.rename(columns={
+        "roi": "ROI",
+        "avg rental price": "Rental Price (avg)",
+        "cards rented": "Amount of Cards Rented"
+    })
+
+    # Crea una colonna 'roi' numerica per ordinamento e highlight
+    df["roi"] = pd.to_numeric(df["ROI"], errors="coerce")
+
+    # Ordina con NaN in fondo
+    return df.sort_values(by="roi", ascending=False, na_position="last").reset_index(drop=True)
+
+
+def write_results_table(df, container):
+    # Colonne da mostrare
+    columns_to_show = ["Card", "ROI", "Rental Price (avg)", "Amount of Cards Rented"]
+
+    container.write(
+        df[columns_to_show]
+        .style.format({
+            "ROI": format_roi,
+            "Rental Price (avg)": "{:.4f}",
+        })
+        .applymap(highlight_roi, subset=["ROI"])  # highlight sulla colonna visibile
+        .to_html(escape=False),
+        unsafe_allow_html=True,
+    )
+
+
+# Show the ROI table and charts of one rental length
+def show_results(data, query_key):
+    if not data:
+        st.warning("No results found with the selected parameters.")
+        return
+
+    df = get_results_df(data)
+
+    # Mostra i risultati
+    st.markdown("## ROI Results 📈")
+
+    market_age = get_market_age()
+    if market_age is not None:
+        st.caption(f"Market prices fetched {market_age:.0f} seconds ago")
+
+    write_results_table(df, st)
+
+    # The workbook is only built on request, row by row from the results
+    # (not from df), and kept for the displayed query only
+    export_button = st.empty()
+    export = st.session_state.get("roi_export")
+    if export is None or export["query"] != query_key:
+        export = None
+        if export_button.button("Prepare Excel export 📄"):
+            output = BytesIO()
+            export_xlsx(data, output)
+            export = {"query": query_key, "xlsx": output.getvalue()}
+            st.session_state["roi_export"] = export
+    if export is not None:
+        export_button.download_button(
+            "Download Excel 📥",
+            data=export["xlsx"],
+            file_name="splinter_roi.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+
+    # Bar chart
+    st.bar_chart(df.set_index("name")["roi"])
+
+    # ROI trend of the same query over the last 30 days
+    trend = get_query_roi_trend(
+        get_roi_history(),
+        query_key,
+        datetime.now() - timedelta(days=30),
+        datetime.now(),
+    )
+    if len({row["run_at"] for row in trend}) > 1:
+        st.markdown("## ROI History 📅")
+        trend_df = pd.DataFrame(trend)
+        trend_df["date"] = pd.to_datetime(trend_df["run_at"], unit="s")
+        trend_df["roi"] = pd.to_numeric(trend_df["roi"], errors="coerce")
+        st.line_chart(
+            trend_df.pivot_table(index="date", columns="name", values="roi")
+        )
+
+
+# Fetch the results of every card of a query, showing a partial table and
+# chart as cards complete. Returns the CardResults in catalog order, or None
+# if the query failed. QUERY_TIMEOUT bounds the whole query: after it the
+# remaining requests are cancelled and the unfinished cards are returned
+# with complete=False
+def run_query(
+    editions_ids,
+    card_types,
+    rarities_ids,
+    foil_id,
+    bcx,
+    colors_ids,
+    rental_length_id,
+):
+    progress = st.progress(0.0, text="Processing cards and calculating ROI...")
+    table = st.empty()
+    chart = st.empty()
+
+    deadline = time.monotonic() + QUERY_TIMEOUT
+    cancel = threading.Event()
+    card_results = []
+    try:
+        session = get_session()
+        with phase("get_cards"):
+            cards = call_with_timeout(
+                get_cards,
+                QUERY_TIMEOUT,
+                cancel,
+                editions_ids,
+                card_types,
+                rarities_ids,
+                colors_ids,
+                session,
+                cancel,
+            )
+        last_update = 0
+
+        for card_result in iter_card_results(
+            cards,
+            foil_id,
+            bcx,
+            session,
+            RENTAL_WORKERS,
+            store=get_rentals_store(),
+            timeout=get_remaining_time(deadline),
+            partial=True,
+            cancel=cancel,
+        ):
+            card_results.append(card_result)
+            progress.progress(
+                len(card_results) / len(cards),
+                text=f"Processed {len(card_results)} of {len(cards)} cards...",
+            )
+
+            if time.time() - last_update >= PARTIAL_RESULTS_INTERVAL:
+                df = get_results_df(
+                    get_partial_result_rows(card_results, rental_length_id)
+                )
+                write_results_table(df, table)
+                chart.bar_chart(df.set_index("name")["roi"])
+                last_update = time.time()
+    except ApiUnavailableError as e:
+        st.error(f"Splinterlands API unavailable: {e}")
+        return None
+    except TimeoutError:
+        st.error(f"The card catalog could not be fetched within {QUERY_TIMEOUT} seconds")
+        return None
+    except (json.JSONDecodeError, KeyError) as e:
+        st.error(f"Data parsing error: {e}")
+        return None
+    except Exception as e:
+        st.error(f"Unexpected error: {e}")
+        return None
+    finally:
+        progress.empty()
+        table.empty()
+        chart.empty()
+
+    positions = {card["id"]: position for position, card in enumerate(cards)}
+    return sorted(card_results, key=lambda card: positions[card.id])
+
+
 # Streamlit application
 def main():
     st.set_page_config(
@@ -145,90 +362,109 @@ def main():
         "Select Rental Length:", options=list(rental_length_mapping.keys()), index=0
     )
 
+    debug = st.sidebar.checkbox("Debug mode 🐞", value=False)
+
+    if BACKGROUND_REFRESH:
+        start_background_refresh()
+        status = get_prefetch_status()
+        st.sidebar.caption(
+            f"Market refreshed {format_age(status['market'])}, "
+            f"rentals refreshed {format_age(status['rentals'])}"
+        )
+        if status["error"]:
+            st.sidebar.caption(f"Last background refresh failed: {status['error']}")
+
+    # The card catalog is cached on disk: force a reload after a new edition ships
+    if st.sidebar.button("Refresh Card Catalog 🔄"):
+        invalidate_catalog()
+        st.sidebar.success("Card catalog will be reloaded on the next query.")
+
+    editions_ids = [str(edition_mapping[e]) for e in editions]
+    rarities_ids = [rarity_mapping[r] for r in rarities]
+    colors_ids = [color_mapping[c] for c in colors] if colors else []
+    foil_id = foil_mapping[foil]
+    rental_length_id = rental_length_mapping[rental_length]
+    card_types = ["Summoner" if x == "Archon" else x for x in card_types]
+
+    # Results cover every rental length: changing only the length reuses them
+    query = (
+        tuple(editions_ids),
+        tuple(card_types),
+        tuple(rarities_ids),
+        foil_id,
+        bcx,
+        tuple(colors_ids),
+    )
+
     if st.sidebar.button("Calculate ROI 📊"):
         if not (editions and card_types and rarities and foil and bcx and rental_length):
             st.sidebar.error(
                 "Please fill in all required filters (Editions, Card Types, Rarities, Foil, BCX, Rental Lenght)!"
             )
         else:
-            editions_ids = [str(edition_mapping[e]) for e in editions]
-            rarities_ids = [rarity_mapping[r] for r in rarities]
-            colors_ids = [color_mapping[c] for c in colors] if colors else []
-            foil_id = foil_mapping[foil]
-            rental_length_id = rental_length_mapping[rental_length]
-            card_types = ["Summoner" if x == "Archon" else x for x in card_types]
-
-            data = []
-
-            with st.spinner("Processing cards and calculating ROI..."):
-                with requests.Session() as session, ThreadPoolExecutor() as executor:                    
-                    future = executor.submit(
-                        check_rental_roi, 
+            st.session_state.pop("roi_results", None)
+            st.session_state.pop("roi_export", None)
+
+            with collect_stats(profile=debug) as stats:
+                card_results = run_query(
+                    editions_ids,
+                    card_types,
+                    rarities_ids,
+                    foil_id,
+                    bcx,
+                    colors_ids,
+                    rental_length_id,
+                )
+            st.session_state["query_stats"] = stats
+            if card_results is None:
+                return
+
+            # Only complete runs go into the ROI history
+            unfinished = sum(not card.complete for card in card_results)
+            history = get_roi_history() if not unfinished else None
+            results = []
+            for length in RENTAL_LENGTHS:
+                if history is not None:
+                    save_history(
+                        history,
+                        card_results,
                         editions_ids,
                         card_types,
                         rarities_ids,
                         foil_id,
                         bcx,
                         colors_ids,
-                        rental_length_id,
-                        session,
+                        length,
                     )
+                results.append(get_partial_result_rows(card_results, length))
 
-                    try:
-                        data = future.result(timeout=60)
-                    except TimeoutError:
-                        st.write(
-                            "Your query is requiring too much time: this might be due to a too complex query (try selecting more filters) or an unresponsive API (try again in a few minutes)"
-                        )
-                        return
-                    except (json.JSONDecodeError, KeyError) as e:
-                        st.error(f"Data parsing error: {e}")
-                        return
-                    except Exception as e:
-                        st.error(f"Unexpected error: {e}")
-                        return
-
-            if not data:
-                st.warning("No results found with the selected parameters.")
-                return
+            if unfinished:
+                st.warning(
+                    f"Your query is requiring too much time: {unfinished} cards could not be fetched and are marked below. "
+                    "This might be due to a too complex query (try selecting more filters) or an unresponsive API (try again in a few minutes)"
+                )
 
-            for d in data:
-                d["Card"] = f"{d['icons']} - {d['name']}"
-
-            df = pd.DataFrame(data)
-            
-            # Rinomina colonne per visualizzazione
-            df = df.rename(columns={
-                "roi": "ROI",
-                "avg rental price": "Rental Price (avg)",
-                "cards rented": "Amount of Cards Rented"
-            })
-            
-            # Crea una colonna 'roi' numerica per ordinamento e highlight
-            df["roi"] = pd.to_numeric(df["ROI"], errors="coerce")
-            
-            # Ordina con NaN in fondo
-            df = df.sort_values(by="roi", ascending=False, na_position="last").reset_index(drop=True)
-            
-            # Mostra i risultati
-            st.markdown("## ROI Results 📈")
-            
-            # Colonne da mostrare
-            columns_to_show = ["Card", "ROI", "Rental Price (avg)", "Amount of Cards Rented"]
-            
-            st.write(
-                df[columns_to_show]
-                .style.format({
-                    "ROI": format_roi,
-                    "Rental Price (avg)": "{:.4f}",
-                })
-                .applymap(highlight_roi, subset=["ROI"])  # highlight sulla colonna visibile
-                .to_html(escape=False),
-                unsafe_allow_html=True,
-            )
-            
-            # Bar chart
-            st.bar_chart(df.set_index("name")["roi"])
+            st.session_state["roi_results"] = {"query": query, "results": results}
+
+    roi_results = st.session_state.get("roi_results")
+    if roi_results and roi_results["query"] == query:
+        query_key = get_query_key(
+            editions_ids,
+            card_types,
+            rarities_ids,
+            foil_id,
+            bcx,
+            colors_ids,
+            rental_length_id,
+        )
+        show_results(roi_results["results"][rental_length_id], query_key)
+
+        stats = st.session_state.get("query_stats")
+        if debug and stats is not None:
+            st.caption(f"🐞 {stats.summary()}")
+            if stats.profile is not None:
+                with st.expander("Profile"):
+                    st.code(stats.profile_report())
 
 
     st.markdown("---")
@@ -0,0 +1,50 @@
+import argparse
+from batch import add_output_arguments, get_output_row, write_output
+from splinter_roi import check_rental_roi_sweep
+
+# Sweep the ROI of every card of the selected editions for every foil and
+# BCX, using every CPU core, and write one table sorted by ROI
+#
+#   python sweep.py --editions 14 17 --foils 0 1 --bcxs 1 2 --output sweep.csv
+
+SWEEP_FIELDS = ["foil", "bcx", "name", "roi", "avg rental price", "cards rented"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the ROI of the whole catalog")
+    parser.add_argument("--editions", nargs="+", required=True, help="edition ids")
+    parser.add_argument(
+        "--types", nargs="+", default=["Monster", "Summoner"], help="card types"
+    )
+    parser.add_argument("--rarities", nargs="+", type=int, default=[1, 2, 3, 4])
+    parser.add_argument("--colours", nargs="*", default=[])
+    parser.add_argument("--foils", nargs="+", type=int, default=[0, 1])
+    parser.add_argument("--bcxs", nargs="+", type=int, default=[1])
+    parser.add_argument("--length", type=int, choices=[0, 1, 2], default=0)
+    add_output_arguments(parser)
+    parser.add_argument(
+        "--processes", type=int, help="worker processes (default: one per CPU core)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="parallel requests per process"
+    )
+    args = parser.parse_args()
+
+    result = check_rental_roi_sweep(
+        args.editions,
+        args.types,
+        args.rarities,
+        args.colours,
+        args.foils,
+        args.bcxs,
+        args.length,
+        processes=args.processes,
+        workers=args.workers,
+    )
+
+    rows = (get_output_row(card, foil=card["foil"], bcx=card["bcx"]) for card in result)
+    write_output(rows, args, SWEEP_FIELDS)
+
+
+if __name__ == "__main__":
+    main()